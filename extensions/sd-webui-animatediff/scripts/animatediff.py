@@ -10,7 +10,10 @@ from scripts.animatediff_logger import logger_animatediff as logger
 from scripts.animatediff_lora import AnimateDiffLora
 from scripts.animatediff_mm import mm_animatediff as motion_module
 from scripts.animatediff_output import AnimateDiffOutput
-from scripts.animatediff_ui import AnimateDiffProcess  # , AnimateDiffUiGroup
+from scripts.animatediff_ui import (
+    AnimateDiffParams,
+    AnimateDiffProcess,
+)  # , AnimateDiffUiGroup
 
 from modules import script_callbacks, scripts, shared
 from modules.processing import Processed  # StableDiffusionProcessingImg2Img,
@@ -43,10 +46,16 @@ class AnimateDiffScript(scripts.Script):
     def before_process(self, p: StableDiffusionProcessing, params: AnimateDiffProcess):
         if isinstance(params, dict):
             params = AnimateDiffProcess(**params)
+        elif isinstance(params, AnimateDiffParams):
+            params = AnimateDiffProcess.from_params(params)
         if params.enable:
             logger.info("AnimateDiff process start.")
             params.set_p(p)
             motion_module.inject(p.sd_model, params.model)
+            if params.compile_motion_module:
+                motion_module.compile(params.compile_mode)
+            else:
+                motion_module.decompile()
             self.lora_hacker = AnimateDiffLora(motion_module.mm.using_v2)
             self.lora_hacker.hack()
             self.cfg_hacker = AnimateDiffInfV2V(p)
@@ -60,6 +69,8 @@ class AnimateDiffScript(scripts.Script):
     ):
         if isinstance(params, dict):
             params = AnimateDiffProcess(**params)
+        elif isinstance(params, AnimateDiffParams):
+            params = AnimateDiffProcess.from_params(params)
         # TODO uncomment this
         # if params.enable and isinstance(p, StableDiffusionProcessingImg2Img):
         #     AnimateDiffI2VLatent().randomize(p, params)
@@ -69,6 +80,8 @@ class AnimateDiffScript(scripts.Script):
     ):
         if isinstance(params, dict):
             params = AnimateDiffProcess(**params)
+        elif isinstance(params, AnimateDiffParams):
+            params = AnimateDiffProcess.from_params(params)
         if params.enable:
             # TODO uncomment this
             # self.cn_hacker.restore()
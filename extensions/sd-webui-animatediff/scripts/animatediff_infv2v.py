@@ -155,7 +155,7 @@ class AnimateDiffInfV2V:
 
         def mm_sd_forward(self, x_in, sigma_in, cond_in, image_cond_in, make_condition_dict):
             x_out = torch.zeros_like(x_in, dtype=x_in.dtype, device=x_in.device)
-            for context in AnimateDiffInfV2V.uniform(self.step, params.video_length, params.batch_size, params.stride, params.overlap, params.closed_loop):
+            for context in AnimateDiffInfV2V.uniform(self.step, params.video_length, params.batch_size, params.stride, params.effective_overlap, params.closed_loop):
                 if shared.opts.batch_cond_uncond:
                     _context = context + [c + params.video_length for c in context]
                 else:
@@ -129,6 +129,49 @@ class AnimateDiffMM:
         self._set_layer_mapping(sd_model)
         logger.info(f"Injection finished.")
 
+    def compile(self, mode="reduce-overhead"):
+        if getattr(self.mm, "compiled_mode", None) == mode or getattr(
+            self.mm, "compile_failed", False
+        ):
+            return
+        logger.info(f"Compiling motion module with torch.compile mode {mode}.")
+        try:
+            for module in self.mm.modules():
+                if isinstance(module, VanillaTemporalModule):
+                    self._compile_forward(module, mode)
+        except RuntimeError as e:
+            logger.warn(f"torch.compile is not available, running eagerly: {e}")
+            self.decompile()
+            return
+        self.mm.compiled_mode = mode
+
+    def _compile_forward(self, module, mode):
+        original_forward = getattr(module, "original_forward", module.forward)
+        module.original_forward = original_forward
+        compiled_forward = torch.compile(original_forward, mode=mode, fullgraph=False)
+
+        def forward(*args, **kwargs):
+            try:
+                return compiled_forward(*args, **kwargs)
+            except torch.cuda.OutOfMemoryError:
+                raise
+            except Exception as e:
+                # inductor only compiles on the first call, so a missing backend (e.g. triton) shows up here
+                logger.warn(f"Compiled motion module failed, running eagerly: {e}")
+                self.decompile()
+                self.mm.compile_failed = True
+                return original_forward(*args, **kwargs)
+
+        module.forward = forward
+
+    def decompile(self):
+        if self.mm is None:
+            return
+        for module in self.mm.modules():
+            if hasattr(module, "original_forward"):
+                module.forward = module.original_forward
+        self.mm.compiled_mode = None
+
     def restore(self, sd_model):
         self._restore_ddim_alpha(sd_model)
         unet = sd_model.model.diffusion_model
@@ -1,4 +1,7 @@
 # import os
+from dataclasses import dataclass, field, fields
+from operator import attrgetter
+from typing import NamedTuple
 
 # import cv2
 # import gradio as gr
@@ -14,82 +17,121 @@
 #         return "button"
 
 
+_VALID_FORMATS = frozenset(("GIF", "MP4", "PNG"))
+
+
+class AnimateDiffParams(NamedTuple):
+    model: str = "mm_sd_v15_v2.ckpt"
+    enable: bool = False
+    video_length: int = 0
+    fps: int = 8
+    loop_number: int = 0
+    closed_loop: bool = False
+    batch_size: int = 16
+    stride: int = 1
+    overlap: int = -1
+    format: tuple = ("GIF", "PNG")
+    interp: str = "Off"
+    interp_x: int = 10
+    reverse: tuple = ()
+    video_source: str = None
+    video_path: str = ""
+    compile_motion_module: bool = False
+    compile_mode: str = "reduce-overhead"
+    latent_power: float = 1
+    latent_scale: float = 32
+    last_frame: object = None
+    latent_power_last: float = 1
+    latent_scale_last: float = 32
+
+
+_DEFAULTS = AnimateDiffParams._field_defaults
+
+
+@dataclass(slots=True)
 class AnimateDiffProcess:
-    def __init__(
-        self,
-        model="mm_sd_v15_v2.ckpt",
-        enable=False,
-        video_length=0,
-        fps=8,
-        loop_number=0,
-        closed_loop=False,
-        batch_size=16,
-        stride=1,
-        overlap=-1,
-        format=["GIF", "PNG"],
-        interp="Off",
-        interp_x=10,
-        reverse=[],
-        video_source=None,
-        video_path="",
-        latent_power=1,
-        latent_scale=32,
-        last_frame=None,
-        latent_power_last=1,
-        latent_scale_last=32,
-    ):
-        self.model = model
-        self.enable = enable
-        self.video_length = video_length
-        self.fps = fps
-        self.loop_number = loop_number
-        self.closed_loop = closed_loop
-        self.batch_size = batch_size
-        self.stride = stride
-        self.overlap = overlap
-        self.format = format
-        self.interp = interp
-        self.interp_x = interp_x
-        self.reverse = reverse
-        self.video_source = video_source
-        self.video_path = video_path
-        self.latent_power = latent_power
-        self.latent_scale = latent_scale
-        self.last_frame = last_frame
-        self.latent_power_last = latent_power_last
-        self.latent_scale_last = latent_scale_last
+    # AnimateDiffParams is the one list of the submitted fields: __reduce__ and
+    # from_params pass them positionally, in its order
+    _FIELDS_IMG2IMG = AnimateDiffParams._fields
+    _FIELDS = _FIELDS_IMG2IMG[: _FIELDS_IMG2IMG.index("latent_power")]
+    _GET_FIELDS = attrgetter(*_FIELDS)
+    _GET_FIELDS_IMG2IMG = attrgetter(*_FIELDS_IMG2IMG)
+
+    model: str = _DEFAULTS["model"]
+    enable: bool = _DEFAULTS["enable"]
+    video_length: int = _DEFAULTS["video_length"]
+    fps: int = _DEFAULTS["fps"]
+    loop_number: int = _DEFAULTS["loop_number"]
+    closed_loop: bool = _DEFAULTS["closed_loop"]
+    batch_size: int = _DEFAULTS["batch_size"]
+    stride: int = _DEFAULTS["stride"]
+    overlap: int = _DEFAULTS["overlap"]
+    format: list = field(default_factory=lambda: list(_DEFAULTS["format"]))
+    interp: str = _DEFAULTS["interp"]
+    interp_x: int = _DEFAULTS["interp_x"]
+    reverse: list = field(default_factory=lambda: list(_DEFAULTS["reverse"]))
+    video_source: str = _DEFAULTS["video_source"]
+    video_path: str = _DEFAULTS["video_path"]
+    compile_motion_module: bool = _DEFAULTS["compile_motion_module"]
+    compile_mode: str = _DEFAULTS["compile_mode"]
+    latent_power: float = _DEFAULTS["latent_power"]
+    latent_scale: float = _DEFAULTS["latent_scale"]
+    last_frame: object = _DEFAULTS["last_frame"]
+    latent_power_last: float = _DEFAULTS["latent_power_last"]
+    latent_scale_last: float = _DEFAULTS["latent_scale_last"]
+    video_default: bool = field(default=False, init=False)
+    effective_overlap: int = field(default=0, init=False)
+    _format_set: frozenset = field(default=frozenset(), init=False, repr=False)
+
+    def __post_init__(self):
+        # copy caller-owned lists so that script_args dicts reused across
+        # hooks (or jobs) never share state with this instance
+        self.format = list(self.format)
+        self.reverse = list(self.reverse)
+        self._format_set = frozenset(self.format)
+        self.effective_overlap = (
+            self.batch_size // 4 if self.overlap == -1 else self.overlap
+        )
+
+    def __reduce__(self):
+        # a single REDUCE with the init values; derived state is rebuilt by
+        # __post_init__ and set_p
+        return (
+            self.__class__,
+            tuple(getattr(self, name) for name in self._FIELDS_IMG2IMG),
+        )
+
+    @classmethod
+    def from_params(cls, params: AnimateDiffParams):
+        return cls(*params)
 
     def get_list(self, is_img2img: bool):
-        list_var = list(vars(self).values())
-        if not is_img2img:
-            list_var = list_var[:-5]
-        return list_var
+        getter = self._GET_FIELDS_IMG2IMG if is_img2img else self._GET_FIELDS
+        return list(getter(self))
 
     def _check(self):
         assert (
             self.video_length >= 0 and self.fps > 0
         ), "Video length and FPS should be positive."
-        assert not set(["GIF", "MP4", "PNG"]).isdisjoint(
-            self.format
+        assert not _VALID_FORMATS.isdisjoint(
+            self._format_set
         ), "At least one saving format should be selected."
 
     def set_p(self, p):
         self._check()
-        if self.video_length < self.batch_size:
-            p.batch_size = self.batch_size
-        else:
-            p.batch_size = self.video_length
-        if self.video_length == 0:
-            self.video_length = p.batch_size
-            self.video_default = True
-        else:
-            self.video_default = False
-        if self.overlap == -1:
-            self.overlap = self.batch_size // 4
-        if "PNG" not in self.format:
+        p.batch_size = max(self.batch_size, self.video_length)
+        self.video_default = self.video_length == 0
+        self.video_length = self.video_length or p.batch_size
+        if "PNG" not in self._format_set:
             p.do_not_save_samples = True
 
 
+assert (
+    tuple(f.name for f in fields(AnimateDiffProcess) if f.init)
+    == AnimateDiffParams._fields
+), "AnimateDiffProcess init fields must match AnimateDiffParams"
+
+
 # class AnimateDiffUiGroup:
 #     txt2img_submit_button = None
 #     img2img_submit_button = None
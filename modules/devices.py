@@ -112,6 +112,23 @@ def without_autocast(disable=False):
     )
 
 
+def inference_mode(disable=False):
+    if disable or not shared.opts.use_inference_mode:
+        return torch.no_grad()
+
+    return torch.inference_mode()
+
+
+def without_inference_mode():
+    """For moving models to another device or dtype during generation: parameters moved under inference mode become
+    inference tensors, and loading weights into them or training them afterwards fails."""
+
+    if not torch.is_inference_mode_enabled():
+        return contextlib.nullcontext()
+
+    return torch.inference_mode(False)
+
+
 class NansException(Exception):
     pass
 
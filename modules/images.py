@@ -357,6 +357,15 @@ def resize_image(resize_mode, im, width, height, upscaler_name=None):
 
         return im
 
+    def fills_target(resized):
+        # when the aspect ratios match there is nothing to pad or fill, and pasting onto a blank
+        # canvas would only copy the image; the input itself is never handed back
+        return (
+            resized.size == (width, height)
+            and resized.mode == "RGB"
+            and resized is not im
+        )
+
     if resize_mode == 0:
         res = resize(im, width, height)
 
@@ -368,6 +377,10 @@ def resize_image(resize_mode, im, width, height, upscaler_name=None):
         src_h = height if ratio <= src_ratio else im.height * width // im.width
 
         resized = resize(im, src_w, src_h)
+
+        if fills_target(resized):
+            return resized
+
         res = Image.new("RGB", (width, height))
         res.paste(resized, box=(width // 2 - src_w // 2, height // 2 - src_h // 2))
 
@@ -379,6 +392,10 @@ def resize_image(resize_mode, im, width, height, upscaler_name=None):
         src_h = height if ratio >= src_ratio else im.height * width // im.width
 
         resized = resize(im, src_w, src_h)
+
+        if fills_target(resized):
+            return resized
+
         res = Image.new("RGB", (width, height))
         res.paste(resized, box=(width // 2 - src_w // 2, height // 2 - src_h // 2))
 
@@ -80,15 +80,17 @@ def expand_crop_region(crop_region, processing_width, processing_height, image_w
     return x1, y1, x2, y2
 
 
-def fill(image, mask):
-    """fills masked regions with colors from image using blur. Not extremely effective."""
+def fill(image, mask, inverted_mask=None):
+    """fills masked regions with colors from image using blur. Not extremely effective.
+    inverted_mask can be given as ImageOps.invert(mask.convert('L')) when filling several images with the same mask."""
+
+    if inverted_mask is None:
+        inverted_mask = ImageOps.invert(mask.convert('L'))
 
     image_mod = Image.new('RGBA', (image.width, image.height))
 
     image_masked = Image.new('RGBa', (image.width, image.height))
-    image_masked.paste(image.convert("RGBA").convert("RGBa"), mask=ImageOps.invert(mask.convert('L')))
-
-    image_masked = image_masked.convert('RGBa')
+    image_masked.paste(image.convert("RGBA").convert("RGBa"), mask=inverted_mask)
 
     for radius, repeats in [(256, 1), (64, 1), (16, 2), (4, 4), (2, 2), (0, 1)]:
         blurred = image_masked.filter(ImageFilter.GaussianBlur(radius)).convert('RGBA')
@@ -2,9 +2,10 @@ import hashlib
 import json
 import math
 import os
-import random
+import secrets
 import sys
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Any, Dict, List
 
 import cv2
@@ -14,7 +15,6 @@ from einops import rearrange, repeat
 from ldm.data.util import AddMiDaS
 from ldm.models.diffusion.ddpm import LatentDepth2ImageDiffusion
 from PIL import Image, ImageOps
-from skimage import exposure
 
 import modules.face_restoration
 import modules.images as images
@@ -38,33 +38,64 @@ from modules import (
 )
 from modules.rng import slerp  # noqa: F401
 from modules.sd_hijack import model_hijack
-from modules.shared import cmd_opts, opts, state
+from modules.shared import opts, state
 
 # some of those options should not be changed at all because they would break the model, so I removed them from options.
 opt_C = 4
 opt_f = 8
 
 
+def channel_histograms(image):
+    """Returns a (channels, 256) array with the histogram of each channel of uint8 HxWxC image."""
+
+    return np.stack(
+        [
+            cv2.calcHist([image], [c], None, [256], [0, 256]).ravel()
+            for c in range(image.shape[2])
+        ]
+    ).astype(np.float64)
+
+
 def setup_color_correction(image):
+    """Returns, for each LAB channel of image, the values present in it and their normalized cumulative
+    histogram; this is everything apply_color_correction needs from the target."""
+
     print("Calibrating color correction.")
-    correction_target = cv2.cvtColor(np.asarray(image.copy()), cv2.COLOR_RGB2LAB)
-    return correction_target
+    correction_target = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2LAB)
+    target_quantiles = []
+    for counts in channel_histograms(correction_target):
+        values = np.flatnonzero(counts)
+        cdf = counts[values].cumsum()
+        target_quantiles.append((values, cdf / cdf[-1]))
+
+    return target_quantiles
+
+
+def histogram_matching_lut(source_counts, target):
+    """Returns a 256-entry uint8 lookup table mapping the values of a uint8 channel with histogram
+    source_counts so that its histogram matches target, a (values, quantiles) pair from
+    setup_color_correction; same result as skimage's match_histograms."""
+
+    target_values, target_quantiles = target
+    source_cdf = source_counts.cumsum()
+
+    return np.interp(
+        source_cdf / source_cdf[-1], target_quantiles, target_values
+    ).astype(np.uint8)
 
 
 def apply_color_correction(correction, original_image):
     from blendmodes.blend import BlendType, blendLayers
 
     print("Applying color correction.")
-    image = Image.fromarray(
-        cv2.cvtColor(
-            exposure.match_histograms(
-                cv2.cvtColor(np.asarray(original_image), cv2.COLOR_RGB2LAB),
-                correction,
-                channel_axis=2,
-            ),
-            cv2.COLOR_LAB2RGB,
-        ).astype("uint8")
-    )
+    lab = cv2.cvtColor(np.asarray(original_image), cv2.COLOR_RGB2LAB)
+    lut = np.empty((1, 256, 3), dtype=np.uint8)
+    for c, counts in enumerate(channel_histograms(lab)):
+        lut[0, :, c] = histogram_matching_lut(counts, correction[c])
+
+    # the LAB buffer is private to this call, so map it in place
+    cv2.LUT(lab, lut, dst=lab)
+    image = Image.fromarray(cv2.cvtColor(lab, cv2.COLOR_LAB2RGB), mode="RGB")
 
     image = blendLayers(image, original_image, BlendType.LUMINOSITY)
 
@@ -77,28 +108,112 @@ def apply_overlay(image, paste_loc, index, overlays):
 
     overlay = overlays[index]
 
-    if paste_loc is not None:
-        x, y, w, h = paste_loc
-        base_image = Image.new("RGBA", (overlay.width, overlay.height))
-        image = images.resize_image(1, image, w, h)
-        base_image.paste(image, (x, y))
-        image = base_image
+    if paste_loc is None:
+        # the image is opaque, so compositing the overlay over it is the same as pasting it through
+        # its own alpha; this skips the round trip through RGBA
+        image = image.convert("RGB") if image.mode != "RGB" else image.copy()
+        image.paste(overlay, (0, 0), overlay)
+
+        return image
+
+    x, y, w, h = paste_loc
+    base_image = Image.new("RGBA", (overlay.width, overlay.height))
+    image = images.resize_image(1, image, w, h)
+    base_image.paste(image, (x, y))
+    image = base_image
 
-    image = image.convert("RGBA")
     image.alpha_composite(overlay)
     image = image.convert("RGB")
 
     return image
 
 
+overlay_executor = None
+
+
+def overlay_uses_upscaler(image, paste_loc):
+    """Tells whether apply_overlay would run opts.upscaler_for_img2img, which happens when the image has to be
+    scaled up to the paste region."""
+
+    if paste_loc is None:
+        return False
+
+    upscaler_name = opts.upscaler_for_img2img
+    if upscaler_name is None or upscaler_name == "None":
+        return False
+
+    _, _, w, h = paste_loc
+    return w > image.width or h > image.height
+
+
+def apply_overlay_in_background(image, paste_loc, index, overlays, infotext):
+    """Submits apply_overlay to a small thread pool, so the PIL work (which mostly releases the GIL) overlaps with
+    the following images and batches; the returned future yields the finished image with its infotext set.
+
+    If the overlay needs the img2img upscaler, which may run a model on the GPU, it is applied right away on this
+    thread instead and the finished image is returned."""
+
+    global overlay_executor
+
+    def finish():
+        result = apply_overlay(image, paste_loc, index, overlays)
+        result.info["parameters"] = infotext
+
+        return result
+
+    if overlay_uses_upscaler(image, paste_loc):
+        return finish()
+
+    if overlay_executor is None:
+        overlay_executor = ThreadPoolExecutor(
+            max_workers=4, thread_name_prefix="apply_overlay"
+        )
+
+    return overlay_executor.submit(finish)
+
+
+binary_mask_lut = [0] * 129 + [255] * 127
+
+
 def create_binary_mask(image):
     if image.mode == "RGBA" and image.getextrema()[-1] != (255, 255):
-        image = image.split()[-1].convert("L").point(lambda x: 255 if x > 128 else 0)
+        image = image.getchannel("A").point(binary_mask_lut)
     else:
         image = image.convert("L")
     return image
 
 
+midas_transformer = None
+
+
+def get_midas_transformer():
+    global midas_transformer
+
+    if midas_transformer is None:
+        midas_transformer = AddMiDaS(model_type="dpt_hybrid")
+
+    return midas_transformer
+
+
+dummy_image_conditionings = {}
+
+
+def dummy_image_conditioning(batch_size, device, dtype):
+    """Returns a shared (batch_size, 5, 1, 1) zero tensor for models that take no image conditioning;
+    it is only ever read for its batch size, so the same tensor can be handed out every time."""
+
+    key = (batch_size, device, dtype)
+    conditioning = dummy_image_conditionings.get(key)
+    if conditioning is None:
+        if len(dummy_image_conditionings) >= 16:
+            dummy_image_conditionings.clear()
+
+        conditioning = torch.zeros(batch_size, 5, 1, 1, dtype=dtype, device=device)
+        dummy_image_conditionings[key] = conditioning
+
+    return conditioning
+
+
 def txt2img_image_conditioning(sd_model, x, width, height):
     if sd_model.model.conditioning_key in {"hybrid", "concat"}:  # Inpainting models
         # The "masked-image" in this case will just be all zeros since the entire image is masked.
@@ -127,7 +242,7 @@ def txt2img_image_conditioning(sd_model, x, width, height):
         # Dummy zero conditioning if we're not using inpainting or unclip models.
         # Still takes up a bit of memory, but no encoder call.
         # Pretty sure we can just make this a 1x1 image since its not going to be used besides its batch size.
-        return x.new_zeros(x.shape[0], 5, 1, 1, dtype=x.dtype, device=x.device)
+        return dummy_image_conditioning(x.shape[0], x.device, x.dtype)
 
 
 class StableDiffusionProcessing:
@@ -260,6 +375,9 @@ class StableDiffusionProcessing:
         self.cached_c = StableDiffusionProcessing.cached_c
         self.uc = None
         self.c = None
+        self.cached_inpainting_mask = None
+        self.inpainting_conditioning_buffer = None
+        self.decoded_samples_buffer = None
         self.rng = rng
 
         self.user = None
@@ -285,8 +403,9 @@ class StableDiffusionProcessing:
 
     def depth2img_image_conditioning(self, source_image):
         # Use the AddMiDaS helper to Format our source image to suit the MiDaS model
-        transformer = AddMiDaS(model_type="dpt_hybrid")
-        transformed = transformer({"jpg": rearrange(source_image[0], "c h w -> h w c")})
+        transformed = get_midas_transformer()(
+            {"jpg": rearrange(source_image[0], "c h w -> h w c")}
+        )
         midas_in = torch.from_numpy(transformed["midas_in"][None, ...]).to(
             device=shared.device
         )
@@ -302,8 +421,12 @@ class StableDiffusionProcessing:
             align_corners=False,
         )
 
+        # rescale to [-1, 1] in place; a flat depth map maps to -1 instead of dividing by zero
         (depth_min, depth_max) = torch.aminmax(conditioning)
-        conditioning = 2.0 * (conditioning - depth_min) / (depth_max - depth_min) - 1.0
+        depth_scale = 2.0 / (depth_max - depth_min).clamp_min(
+            torch.finfo(conditioning.dtype).eps
+        )
+        conditioning.sub_(depth_min).mul_(depth_scale).sub_(1.0)
         return conditioning
 
     def edit_image_conditioning(self, source_image):
@@ -337,11 +460,13 @@ class StableDiffusionProcessing:
                 conditioning_mask = image_mask
             else:
                 conditioning_mask = np.array(image_mask.convert("L"))
-                conditioning_mask = conditioning_mask.astype(np.float32) / 255.0
-                conditioning_mask = torch.from_numpy(conditioning_mask[None, None])
+                conditioning_mask = torch.from_numpy(conditioning_mask[None, None]).to(
+                    device=source_image.device
+                )
 
-                # Inpainting model uses a discretized mask as input, so we round to either 1.0 or 0.0
-                conditioning_mask = torch.round(conditioning_mask)
+                # Inpainting model uses a discretized mask as input, so we round to either 1.0 or 0.0;
+                # round(x / 255) is 1 exactly when x >= 128, which can be tested on the uint8 values
+                conditioning_mask = conditioning_mask >= 128
         else:
             conditioning_mask = source_image.new_ones(1, 1, *source_image.shape[-2:])
 
@@ -350,11 +475,11 @@ class StableDiffusionProcessing:
         conditioning_mask = conditioning_mask.to(
             device=source_image.device, dtype=source_image.dtype
         )
-        conditioning_image = torch.lerp(
-            source_image,
-            source_image * (1.0 - conditioning_mask),
-            getattr(self, "inpainting_mask_weight", shared.opts.inpainting_mask_weight),
+        # lerp(a, a * (1 - m), w) == a * (1 - w * m), without the intermediate masked image
+        mask_weight = getattr(
+            self, "inpainting_mask_weight", shared.opts.inpainting_mask_weight
         )
+        conditioning_image = source_image * (1.0 - mask_weight * conditioning_mask)
 
         # Encode the new masked image using first stage of network.
         conditioning_image = self.sd_model.get_first_stage_encoding(
@@ -362,16 +487,51 @@ class StableDiffusionProcessing:
         )
 
         # Create the concatenated conditioning tensor to be fed to `c_concat`
-        conditioning_mask = torch.nn.functional.interpolate(
-            conditioning_mask, size=latent_image.shape[-2:]
-        )
-        conditioning_mask = conditioning_mask.expand(
-            conditioning_image.shape[0], -1, -1, -1
+        # the downscaled mask only depends on image_mask and the latent size, so keep it across calls;
+        # nearest (interpolate's default) keeps the mask binary; like in depth2img_image_conditioning,
+        # inference tensor masks cannot be checked for in-place changes and are not cached
+        mask_is_tensor = torch.is_tensor(image_mask)
+        cacheable = not (mask_is_tensor and image_mask.is_inference())
+        cache_key = (
+            image_mask._version if mask_is_tensor and cacheable else None,
+            tuple(latent_image.shape[-2:]),
+            conditioning_mask.device,
+            conditioning_mask.dtype,
         )
-        image_conditioning = torch.cat([conditioning_mask, conditioning_image], dim=1)
-        image_conditioning = image_conditioning.to(shared.device).type(
-            self.sd_model.dtype
+        cached = self.cached_inpainting_mask
+        if (
+            cacheable
+            and cached is not None
+            and cached[0] is image_mask
+            and cached[1] == cache_key
+        ):
+            conditioning_mask = cached[2]
+        else:
+            conditioning_mask = torch.nn.functional.interpolate(
+                conditioning_mask, size=latent_image.shape[-2:], mode="nearest"
+            )
+            if cacheable:
+                self.cached_inpainting_mask = (image_mask, cache_key, conditioning_mask)
+
+        # write mask and image into a buffer kept across calls instead of allocating a new one with torch.cat;
+        # the previous result is no longer in use by the time the next one is requested
+        batch_size, channels, height, width = conditioning_image.shape
+        shape = (batch_size, channels + 1, height, width)
+        image_conditioning = self.inpainting_conditioning_buffer
+        if (
+            image_conditioning is None
+            or image_conditioning.shape != shape
+            or image_conditioning.dtype != self.sd_model.dtype
+        ):
+            image_conditioning = torch.empty(
+                shape, device=shared.device, dtype=self.sd_model.dtype
+            )
+            self.inpainting_conditioning_buffer = image_conditioning
+
+        image_conditioning[:, :1].copy_(
+            conditioning_mask.expand(batch_size, -1, -1, -1)
         )
+        image_conditioning[:, 1:].copy_(conditioning_image)
 
         return image_conditioning
 
@@ -395,7 +555,9 @@ class StableDiffusionProcessing:
             return self.unclip_image_conditioning(source_image)
 
         # Dummy zero conditioning if we're not using inpainting or depth model.
-        return latent_image.new_zeros(latent_image.shape[0], 5, 1, 1)
+        return dummy_image_conditioning(
+            latent_image.shape[0], latent_image.device, latent_image.dtype
+        )
 
     def init(self, all_prompts, all_seeds, all_subseeds):
         pass
@@ -415,6 +577,9 @@ class StableDiffusionProcessing:
         self.sampler = None
         self.c = None
         self.uc = None
+        self.cached_inpainting_mask = None
+        self.inpainting_conditioning_buffer = None
+        self.decoded_samples_buffer = None
         if not opts.experimental_persistent_cond_cache:
             StableDiffusionProcessing.cached_c = [None, None]
             StableDiffusionProcessing.cached_uc = [None, None]
@@ -430,27 +595,27 @@ class StableDiffusionProcessing:
 
         return self.token_merging_ratio or opts.token_merging_ratio
 
-    def setup_prompts(self):
-        if type(self.prompt) == list:
-            self.all_prompts = self.prompt
-        else:
-            self.all_prompts = self.batch_size * self.n_iter * [self.prompt]
+    def style_prompts(self, prompt, apply_styles):
+        """Returns the list of batch_size * n_iter styled prompts for prompt (a string or a list of them),
+        calling apply_styles once per distinct prompt."""
 
-        if type(self.negative_prompt) == list:
-            self.all_negative_prompts = self.negative_prompt
-        else:
-            self.all_negative_prompts = (
-                self.batch_size * self.n_iter * [self.negative_prompt]
-            )
+        if not isinstance(prompt, list):
+            return self.batch_size * self.n_iter * [apply_styles(prompt, self.styles)]
 
-        self.all_prompts = [
-            shared.prompt_styles.apply_styles_to_prompt(x, self.styles)
-            for x in self.all_prompts
-        ]
-        self.all_negative_prompts = [
-            shared.prompt_styles.apply_negative_styles_to_prompt(x, self.styles)
-            for x in self.all_negative_prompts
-        ]
+        styled = {}
+        for x in prompt:
+            if x not in styled:
+                styled[x] = apply_styles(x, self.styles)
+
+        return [styled[x] for x in prompt]
+
+    def setup_prompts(self):
+        self.all_prompts = self.style_prompts(
+            self.prompt, shared.prompt_styles.apply_styles_to_prompt
+        )
+        self.all_negative_prompts = self.style_prompts(
+            self.negative_prompt, shared.prompt_styles.apply_negative_styles_to_prompt
+        )
 
         self.main_prompt = self.all_prompts[0]
         self.main_negative_prompt = self.all_negative_prompts[0]
@@ -470,16 +635,17 @@ class StableDiffusionProcessing:
         caches is a list with items described above.
         """
 
+        # cheap scalar fields go first so that a mismatch is found before the prompt lists are compared
         cached_params = (
-            required_prompts,
             steps,
+            self.width,
+            self.height,
             opts.CLIP_stop_at_last_layers,
-            shared.sd_model.sd_checkpoint_info,
-            extra_network_data,
             opts.sdxl_crop_left,
             opts.sdxl_crop_top,
-            self.width,
-            self.height,
+            shared.sd_model.sd_checkpoint_info,
+            required_prompts,
+            extra_network_data,
         )
 
         for cache in caches:
@@ -587,19 +753,19 @@ class Processed:
         self.s_noise = p.s_noise
         self.s_min_uncond = p.s_min_uncond
         self.sampler_noise_scheduler_override = p.sampler_noise_scheduler_override
-        self.prompt = self.prompt if type(self.prompt) != list else self.prompt[0]
+        self.prompt = self.prompt[0] if isinstance(self.prompt, list) else self.prompt
         self.negative_prompt = (
             self.negative_prompt
-            if type(self.negative_prompt) != list
+            if not isinstance(self.negative_prompt, list)
             else self.negative_prompt[0]
         )
         self.seed = (
-            int(self.seed if type(self.seed) != list else self.seed[0])
+            int(self.seed[0] if isinstance(self.seed, list) else self.seed)
             if self.seed is not None
             else -1
         )
         self.subseed = (
-            int(self.subseed if type(self.subseed) != list else self.subseed[0])
+            int(self.subseed[0] if isinstance(self.subseed, list) else self.subseed)
             if self.subseed is not None
             else -1
         )
@@ -651,23 +817,6 @@ class Processed:
         return self.token_merging_ratio_hr if for_hr else self.token_merging_ratio
 
 
-# from https://discuss.pytorch.org/t/help-regarding-slerp-function-for-generative-model-sampling/32475/3
-def slerp(val, low, high):
-    low_norm = low / torch.norm(low, dim=1, keepdim=True)
-    high_norm = high / torch.norm(high, dim=1, keepdim=True)
-    dot = (low_norm * high_norm).sum(1)
-
-    if dot.mean() > 0.9995:
-        return low * val + high * (1 - val)
-
-    omega = torch.acos(dot)
-    so = torch.sin(omega)
-    res = (torch.sin((1.0 - val) * omega) / so).unsqueeze(1) * low + (
-        torch.sin(val * omega) / so
-    ).unsqueeze(1) * high
-    return res
-
-
 def create_random_tensors(
     shape,
     seeds,
@@ -689,14 +838,26 @@ def create_random_tensors(
 
 
 def decode_latent_batch(model, batch, target_device=None, check_for_nans=False):
-    samples = []
+    return list(
+        decode_latent_samples(
+            model, batch, target_device=target_device, check_for_nans=check_for_nans
+        ).unbind(0)
+    )
+
 
-    for i in range(batch.shape[0]):
-        sample = decode_first_stage(model, batch[i : i + 1])[0]
+def decode_latent_samples(model, batch, target_device=None, check_for_nans=False):
+    """Same as decode_latent_batch, but returns the decoded batch as a single 4D tensor instead of a list."""
 
-        if check_for_nans:
+    def decode_with_nan_check(batch):
+        samples = decode_first_stage(model, batch)
+
+        if check_for_nans and not shared.cmd_opts.disable_nan_check:
             try:
-                devices.test_for_nans(sample, "vae")
+                # one pass and one device sync for the whole batch instead of one per sample;
+                # test_for_nans then raises its usual error for the first sample that is all NaNs
+                all_nans = torch.isnan(samples).flatten(1).all(dim=1)
+                if all_nans.any():
+                    devices.test_for_nans(samples[int(all_nans.nonzero()[0])], "vae")
             except devices.NansException as e:
                 if (
                     devices.dtype_vae == torch.float32
@@ -710,28 +871,108 @@ def decode_latent_batch(model, batch, target_device=None, check_for_nans=False):
                 )
 
                 devices.dtype_vae = torch.float32
-                model.first_stage_model.to(devices.dtype_vae)
-                batch = batch.to(devices.dtype_vae)
+                with devices.without_inference_mode():
+                    model.first_stage_model.to(devices.dtype_vae)
+
+                samples = decode_first_stage(model, batch)
+
+        return samples
+
+    # decode the whole batch in one VAE call; fall back to one sample at a time if that does not fit
+    out_of_memory = False
+    try:
+        samples = decode_with_nan_check(batch)
+    except torch.cuda.OutOfMemoryError:
+        # the exception's traceback keeps the failed call's frames and activations alive, so the memory can only be
+        # released, and the smaller decodes tried, once the except block has been left
+        out_of_memory = True
+
+    if out_of_memory:
+        devices.torch_gc()
 
-                sample = decode_first_stage(model, batch[i : i + 1])[0]
+        # each sample is written straight into its slice of the output rather than collected and concatenated,
+        # which would need memory for the whole batch twice right when memory is short
+        sample = decode_with_nan_check(batch[:1])
+        samples = sample.new_empty((batch.shape[0], *sample.shape[1:]))
+        samples[:1] = sample
+        del sample
 
-        if target_device is not None:
-            sample = sample.to(target_device)
+        for i in range(1, batch.shape[0]):
+            samples[i : i + 1] = decode_with_nan_check(batch[i : i + 1])
 
-        samples.append(sample)
+    if target_device is not None:
+        samples = samples.to(target_device)
 
     return samples
 
 
+def samples_to_uint8(x_samples):
+    """Converts decoded samples with values from 0 to 1 into HWC uint8 arrays. x_samples is either a 4D tensor
+    or a list of 3D tensors; same-sized samples are converted together in one pass rather than one at a time."""
+
+    if not isinstance(x_samples, torch.Tensor):
+        if not x_samples:
+            return []
+
+        if any(x.shape != x_samples[0].shape for x in x_samples):
+            return [samples_to_uint8(x[None])[0] for x in x_samples]
+
+        x_samples = torch.stack(x_samples)
+
+    # the multiply and the truncating cast match the previous 255.0 * array -> astype(np.uint8);
+    # both keep a channels last layout, in which case contiguous() below has nothing left to do
+    x_samples = x_samples.cpu().mul(255.0).to(torch.uint8).permute(0, 2, 3, 1)
+
+    return list(x_samples.contiguous().numpy())
+
+
+def compile_vae_decoder(first_stage_model):
+    """Replaces the VAE's decode with a torch.compile wrapper around it, once per model; the original is kept
+    as original_decode."""
+
+    if hasattr(first_stage_model, "original_decode"):
+        return
+
+    # torch.compile can already fail here, so nothing is assigned until the wrapper exists
+    compiled_decode = torch.compile(first_stage_model.decode)
+    first_stage_model.original_decode = first_stage_model.decode
+    first_stage_model.decode = compiled_decode
+
+
+def restore_vae_decoder(first_stage_model):
+    if hasattr(first_stage_model, "original_decode"):
+        first_stage_model.decode = first_stage_model.original_decode
+        del first_stage_model.original_decode
+
+
 def decode_first_stage(model, x):
-    x = model.decode_first_stage(x.to(model.device).to(devices.dtype_vae))
+    x = x.to(model.device).to(devices.dtype_vae)
+
+    if not shared.opts.compile_vae_decoder or getattr(
+        model.first_stage_model, "compile_failed", False
+    ):
+        restore_vae_decoder(model.first_stage_model)
+        return model.decode_first_stage(x)
+
+    try:
+        compile_vae_decoder(model.first_stage_model)
+        return model.decode_first_stage(x)
+    except torch.cuda.OutOfMemoryError:
+        raise
+    except Exception:
+        # torch.compile fails either while building the wrapper or on the first call; both fall back to eager
+        errors.report(
+            "Error compiling VAE decoder, decoding without torch.compile", exc_info=True
+        )
+        model.first_stage_model.compile_failed = True
+        restore_vae_decoder(model.first_stage_model)
 
-    return x
+        return model.decode_first_stage(x)
 
 
 def get_fixed_seed(seed):
     if seed is None or seed == "" or seed == -1:
-        return int(random.randrange(4294967294))
+        return secrets.randbelow(4294967294)
 
     return seed
 
@@ -745,50 +986,34 @@ def program_version():
     return "v1.6.0"
 
 
-def create_infotext(
-    p,
-    all_prompts,
-    all_seeds,
-    all_subseeds,
-    comments=None,
-    iteration=0,
-    position_in_batch=0,
-    use_main_prompt=False,
-    index=None,
-    all_negative_prompts=None,
-):
-    if index is None:
-        index = position_in_batch + iteration * p.batch_size
-
-    if all_negative_prompts is None:
-        all_negative_prompts = p.all_negative_prompts
+def create_infotext_generation_params(p):
+    """Returns the generation parameters of create_infotext that are shared by every image of a batch.
+    "Seed" and "Variation seed" are placeholders, filled in per image by create_infotext."""
 
     clip_skip = getattr(p, "clip_skip", opts.CLIP_stop_at_last_layers)
     enable_hr = getattr(p, "enable_hr", False)
     token_merging_ratio = p.get_token_merging_ratio()
     token_merging_ratio_hr = p.get_token_merging_ratio(for_hr=True)
+    add_model_hash_to_info = opts.add_model_hash_to_info
+    add_model_name_to_info = opts.add_model_name_to_info
 
     uses_ensd = opts.eta_noise_seed_delta != 0
     if uses_ensd:
         uses_ensd = sd_samplers_common.is_sampler_using_eta_noise_seed_delta(p)
 
-    generation_params = {
+    return {
         "Steps": p.steps,
         "Sampler": p.sampler_name,
         "CFG scale": p.cfg_scale,
         "Image CFG scale": getattr(p, "image_cfg_scale", None),
-        "Seed": p.all_seeds[0] if use_main_prompt else all_seeds[index],
+        "Seed": None,
         "Face restoration": opts.face_restoration_model if p.restore_faces else None,
         "Size": f"{p.width}x{p.height}",
-        "Model hash": p.sd_model_hash if opts.add_model_hash_to_info else None,
-        "Model": p.sd_model_name if opts.add_model_name_to_info else None,
-        "VAE hash": p.sd_vae_hash if opts.add_model_hash_to_info else None,
-        "VAE": p.sd_vae_name if opts.add_model_name_to_info else None,
-        "Variation seed": (
-            None
-            if p.subseed_strength == 0
-            else (p.all_subseeds[0] if use_main_prompt else all_subseeds[index])
-        ),
+        "Model hash": p.sd_model_hash if add_model_hash_to_info else None,
+        "Model": p.sd_model_name if add_model_name_to_info else None,
+        "VAE hash": p.sd_vae_hash if add_model_hash_to_info else None,
+        "VAE": p.sd_vae_name if add_model_name_to_info else None,
+        "Variation seed": None,
         "Variation seed strength": (
             None if p.subseed_strength == 0 else p.subseed_strength
         ),
@@ -820,17 +1045,86 @@ def create_infotext(
         "User": p.user if opts.add_user_name_to_info else None,
     }
 
-    def quote(text):
-        if "," not in str(text) and "\n" not in str(text) and ":" not in str(text):
-            return text
 
-        return json.dumps(text, ensure_ascii=False)
+def render_generation_param(key, value):
+    """Formats one generation parameter for the infotext; returns None for parameters that are left out."""
+
+    if value is None:
+        return None
+
+    if key == value:
+        return key
+
+    text = str(value)
+    if "," in text or "\n" in text or ":" in text:
+        value = json.dumps(value, ensure_ascii=False)
+
+    return f"{key}: {value}"
+
+
+rendered_generation_params = (None, None)
+
+
+def render_generation_params(generation_params):
+    """Returns (key, text) pairs for generation_params, rendering them only the first time the same
+    dict is passed in, which is what happens for every image of a batch."""
+
+    global rendered_generation_params
+
+    if rendered_generation_params[0] is not generation_params:
+        rendered_generation_params = (
+            generation_params,
+            [(k, render_generation_param(k, v)) for k, v in generation_params.items()],
+        )
+
+    return rendered_generation_params[1]
+
+
+def create_infotext(
+    p,
+    all_prompts,
+    all_seeds,
+    all_subseeds,
+    comments=None,
+    iteration=0,
+    position_in_batch=0,
+    use_main_prompt=False,
+    index=None,
+    all_negative_prompts=None,
+    generation_params=None,
+):
+    if index is None:
+        index = position_in_batch + iteration * p.batch_size
+
+    if all_negative_prompts is None:
+        all_negative_prompts = p.all_negative_prompts
+
+    if generation_params is None:
+        generation_params = create_infotext_generation_params(p)
+
+    # as before, extra_generation_params take precedence over the per-image values
+    image_params = {}
+    if "Seed" not in p.extra_generation_params:
+        image_params["Seed"] = p.all_seeds[0] if use_main_prompt else all_seeds[index]
+    if "Variation seed" not in p.extra_generation_params:
+        image_params["Variation seed"] = (
+            None
+            if p.subseed_strength == 0
+            else (p.all_subseeds[0] if use_main_prompt else all_subseeds[index])
+        )
 
+    # the shared entries are rendered once per generation_params; only the per-image ones are rendered here,
+    # in the place their key has in generation_params
     generation_params_text = ", ".join(
         [
-            k if k == v else f"{k}: {quote(v)}"
-            for k, v in generation_params.items()
-            if v is not None
+            text
+            for text in (
+                render_generation_param(k, image_params[k])
+                if k in image_params
+                else text
+                for k, text in render_generation_params(generation_params)
+            )
+            if text is not None
         ]
     )
 
@@ -897,7 +1191,7 @@ def process_images(p: StableDiffusionProcessing) -> Processed:
 def process_images_inner(p: StableDiffusionProcessing) -> Processed:
     """this is the main loop that both txt2img and img2img use; it calls func_init once inside all the scopes and func_sample once per batch"""
 
-    if type(p.prompt) == list:
+    if isinstance(p.prompt, list):
         assert len(p.prompt) > 0
     else:
         assert p.prompt is not None
@@ -914,7 +1208,7 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
 
     p.setup_prompts()
 
-    if type(seed) == list:
+    if isinstance(seed, list):
         p.all_seeds = seed
     else:
         p.all_seeds = [
@@ -922,12 +1216,13 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
             for x in range(len(p.all_prompts))
         ]
 
-    if type(subseed) == list:
+    if isinstance(subseed, list):
         p.all_subseeds = subseed
     else:
         p.all_subseeds = [int(subseed) + x for x in range(len(p.all_prompts))]
 
-    if os.path.exists(cmd_opts.embeddings_dir) and not p.do_not_reload_embeddings:
+    # this only reloads anything if an embeddings directory's mtime changed; missing directories are skipped there
+    if not p.do_not_reload_embeddings:
         model_hijack.embedding_db.load_textual_inversion_embeddings()
 
     if p.scripts is not None:
@@ -936,7 +1231,11 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
     infotexts = []
     output_images = []
 
-    with torch.no_grad(), p.sd_model.ema_scope():
+    # lowvram and medvram move modules between devices in forward hooks throughout generation, which must not
+    # happen under inference mode
+    with devices.inference_mode(
+        disable=lowvram.is_enabled(p.sd_model)
+    ), p.sd_model.ema_scope():
         with devices.autocast():
             p.init(p.all_prompts, p.all_seeds, p.all_subseeds)
 
@@ -952,6 +1251,32 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
         if state.job_count == -1:
             state.job_count = p.n_iter
 
+        # every batch has its own seeds and thus its own generators, but the latent shape is the same for all of them
+        rng_shape = (opt_C, p.height // opt_f, p.width // opt_f)
+
+        infotext_generation_params = (None, None)
+
+        def infotext(index=0, use_main_prompt=False):
+            nonlocal infotext_generation_params
+
+            extra_params = list(p.extra_generation_params.items())
+            if infotext_generation_params[0] != extra_params:
+                infotext_generation_params = (
+                    extra_params,
+                    create_infotext_generation_params(p),
+                )
+
+            return create_infotext(
+                p,
+                p.prompts,
+                p.seeds,
+                p.subseeds,
+                use_main_prompt=use_main_prompt,
+                index=index,
+                all_negative_prompts=p.negative_prompts,
+                generation_params=infotext_generation_params[1],
+            )
+
         for n in range(p.n_iter):
             p.iteration = n
 
@@ -961,15 +1286,17 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
             if state.interrupted:
                 break
 
-            p.prompts = p.all_prompts[n * p.batch_size : (n + 1) * p.batch_size]
-            p.negative_prompts = p.all_negative_prompts[
-                n * p.batch_size : (n + 1) * p.batch_size
-            ]
-            p.seeds = p.all_seeds[n * p.batch_size : (n + 1) * p.batch_size]
-            p.subseeds = p.all_subseeds[n * p.batch_size : (n + 1) * p.batch_size]
+            start, stop = n * p.batch_size, (n + 1) * p.batch_size
+            prompts = p.prompts = p.all_prompts[start:stop]
+            negative_prompts = p.negative_prompts = p.all_negative_prompts[start:stop]
+            p.seeds = p.all_seeds[start:stop]
+            p.subseeds = p.all_subseeds[start:stop]
+
+            # built on first use and rebuilt only if scripts change extra_generation_params afterwards
+            infotext_generation_params = (None, None)
 
             p.rng = rng.ImageRNG(
-                (opt_C, p.height // opt_f, p.width // opt_f),
+                rng_shape,
                 p.seeds,
                 subseeds=p.subseeds,
                 subseed_strength=p.subseed_strength,
@@ -986,17 +1313,6 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                     subseeds=p.subseeds,
                 )
 
-            def infotext(index=0, use_main_prompt=False):
-                return create_infotext(
-                    p,
-                    p.prompts,
-                    p.seeds,
-                    p.subseeds,
-                    use_main_prompt=use_main_prompt,
-                    index=index,
-                    all_negative_prompts=p.negative_prompts,
-                )
-
             if len(p.prompts) == 0:
                 break
 
@@ -1041,67 +1357,107 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
             # x_samples_ddim = torch.clamp((x_samples_ddim + 1.0) / 2.0, min=0.0, max=1.0)
             decode_start_time = time.monotonic()
             print(f"Decoding latents in {samples_ddim.device}...")
-            x_samples_ddim = decode_latent_batch(
+            x_samples_ddim = decode_latent_samples(
                 p.sd_model,
                 samples_ddim,
                 # target_device=devices.device,
                 check_for_nans=True,
             )
-            x_samples_ddim = torch.stack(x_samples_ddim).float()
-            x_samples_ddim = torch.clamp((x_samples_ddim + 1.0) / 2.0, min=0.0, max=1.0)
+            # half precision is plenty for values that end up as uint8, so on CUDA the rescale runs in the
+            # VAE's dtype and the upcast happens on the way to the host; half ops on the CPU are slow
+            if not (
+                x_samples_ddim.dtype == torch.float16
+                and x_samples_ddim.device.type == "cuda"
+            ):
+                x_samples_ddim = x_samples_ddim.float()
+            # the batch is a fresh tensor here, so rescale it in place instead of through two temporaries
+            x_samples_ddim = x_samples_ddim.add_(1.0).mul_(0.5).clamp_(min=0.0, max=1.0)
             print(f"done in {round(time.monotonic() - decode_start_time, 2)}s")
 
             move_to_cpu_start_time = time.monotonic()
             print("Move latents to cpu...")
-            x_samples_ddim = x_samples_ddim.to(devices.cpu)
-            print(f"done in {round(time.monotonic() - move_to_cpu_start_time, 2)}s")
+            if x_samples_ddim.device.type == "cuda":
+                # copies into pinned memory skip the staging buffer a pageable copy goes through; pinning is
+                # expensive, so the buffer is kept for the following batches;
+                # it is always float32, which is what scripts get to see
+                buffer = p.decoded_samples_buffer
+                if (
+                    buffer is None
+                    or buffer.shape[0] < x_samples_ddim.shape[0]
+                    or buffer.shape[1:] != x_samples_ddim.shape[1:]
+                ):
+                    buffer = torch.empty(
+                        x_samples_ddim.shape,
+                        dtype=torch.float32,
+                        memory_format=torch.channels_last,
+                        pin_memory=True,
+                    )
+                    p.decoded_samples_buffer = buffer
+
+                # the transpose to channels last is cheap on the GPU and makes the HWC view that samples_to_uint8
+                # takes on the host already contiguous, instead of leaving that transpose to the CPU
+                x_samples_ddim = x_samples_ddim.contiguous(
+                    memory_format=torch.channels_last
+                )
+
+                x_samples_ddim = buffer[: x_samples_ddim.shape[0]].copy_(x_samples_ddim)
+            else:
+                x_samples_ddim = x_samples_ddim.to(devices.cpu)
             del samples_ddim
 
-            if lowvram.is_enabled(shared.sd_model):
+            # releasing the CUDA cache stalls the stream and makes the allocator grab the memory again on the next
+            # batch, so it is only worth it when the models are being moved in and out of VRAM anyway
+            release_memory = lowvram.is_enabled(shared.sd_model)
+            if release_memory:
                 lowvram.send_everything_to_cpu()
+                devices.torch_gc()
 
-            devices.torch_gc()
+            print(f"done in {round(time.monotonic() - move_to_cpu_start_time, 2)}s")
 
             if p.scripts is not None:
                 p.scripts.postprocess_batch(p, x_samples_ddim, batch_number=n)
 
-                p.prompts = p.all_prompts[n * p.batch_size : (n + 1) * p.batch_size]
-                p.negative_prompts = p.all_negative_prompts[
-                    n * p.batch_size : (n + 1) * p.batch_size
-                ]
+                # postprocess_batch_list starts from this batch's prompts even if postprocess_batch replaced them
+                p.prompts = prompts
+                p.negative_prompts = negative_prompts
+
+                # without a script to receive it, the batch stays one tensor instead of a list of per-image views
+                if p.scripts.has_postprocess_batch_list():
+                    batch_params = scripts.PostprocessBatchListArgs(
+                        list(x_samples_ddim)
+                    )
+                    p.scripts.postprocess_batch_list(p, batch_params, batch_number=n)
+                    x_samples_ddim = batch_params.images
 
-                batch_params = scripts.PostprocessBatchListArgs(list(x_samples_ddim))
-                p.scripts.postprocess_batch_list(p, batch_params, batch_number=n)
-                x_samples_ddim = batch_params.images
+            # plain txt2img has no overlays, so it skips apply_overlay altogether
+            overlay_images = p.overlay_images
 
-            for i, x_sample in enumerate(x_samples_ddim):
-                p.batch_index = i
+            # settings are read once per batch rather than for every image
+            save_before_face_restoration = (
+                opts.save
+                and not p.do_not_save_samples
+                and opts.save_images_before_face_restoration
+            )
+            samples_format = opts.samples_format
 
-                x_sample = 255.0 * np.moveaxis(x_sample.cpu().numpy(), 0, 2)
-                x_sample = x_sample.astype(np.uint8)
+            for i, x_sample in enumerate(samples_to_uint8(x_samples_ddim)):
+                p.batch_index = i
 
                 if p.restore_faces:
-                    if (
-                        opts.save
-                        and not p.do_not_save_samples
-                        and opts.save_images_before_face_restoration
-                    ):
+                    if save_before_face_restoration:
                         images.save_image(
                             Image.fromarray(x_sample),
                             p.outpath_samples,
                             "",
                             p.seeds[i],
                             p.prompts[i],
-                            opts.samples_format,
+                            samples_format,
                             info="",
                             p=p,
                             suffix="-before-face-restoration",
                         )
 
-                    devices.torch_gc()
-
                     x_sample = modules.face_restoration.restore_faces(x_sample)
-                    devices.torch_gc()
 
                 image = Image.fromarray(x_sample)
 
@@ -1110,16 +1466,25 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                     p.scripts.postprocess_image(p, pp)
                     image = pp.image
 
-                image = apply_overlay(image, p.paste_to, i, p.overlay_images)
-
                 text = infotext(i)
                 infotexts.append(text)
-                image.info["parameters"] = text
-                output_images.append(image)
+
+                if overlay_images is not None and i < len(overlay_images):
+                    # scripts and face restoration above share p and the GPU, so only the overlay is moved off
+                    # this thread; the batch loop goes on while it runs
+                    output_images.append(
+                        apply_overlay_in_background(
+                            image, p.paste_to, i, overlay_images, text
+                        )
+                    )
+                else:
+                    image.info["parameters"] = text
+                    output_images.append(image)
 
             del x_samples_ddim
 
-            devices.torch_gc()
+            if release_memory:
+                devices.torch_gc()
 
             state.nextjob()
 
@@ -1132,6 +1497,11 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
 
     devices.torch_gc()
 
+    output_images = [
+        image.result() if isinstance(image, Future) else image
+        for image in output_images
+    ]
+
     res = Processed(
         p,
         images_list=output_images,
@@ -1322,16 +1692,20 @@ class StableDiffusionProcessingTxt2Img(StableDiffusionProcessing):
     ):
         self.sampler = sd_samplers.create_sampler(self.sampler_name, self.sd_model)
 
-        latent_scale_mode = (
-            shared.latent_upscale_modes.get(self.hr_upscaler, None)
-            if self.hr_upscaler is not None
-            else shared.latent_upscale_modes.get(
-                shared.latent_upscale_default_mode, "nearest"
+        # init() turns enable_hr off when the hires pass would do nothing, so the hires setup is skipped then too
+        if self.enable_hr:
+            latent_scale_mode = (
+                shared.latent_upscale_modes.get(self.hr_upscaler, None)
+                if self.hr_upscaler is not None
+                else shared.latent_upscale_modes.get(
+                    shared.latent_upscale_default_mode, "nearest"
+                )
             )
-        )
-        if self.enable_hr and latent_scale_mode is None:
-            if not any(x.name == self.hr_upscaler for x in shared.sd_upscalers):
-                raise Exception(f"could not find upscaler named {self.hr_upscaler}")
+            if latent_scale_mode is None:
+                if not any(x.name == self.hr_upscaler for x in shared.sd_upscalers):
+                    raise Exception(
+                        f"could not find upscaler named {self.hr_upscaler}"
+                    )
 
         x = self.rng.next()
 
@@ -1379,9 +1753,7 @@ class StableDiffusionProcessingTxt2Img(StableDiffusionProcessing):
             )
 
             batch_images = []
-            for i, x_sample in enumerate(lowres_samples):
-                x_sample = 255.0 * np.moveaxis(x_sample.cpu().numpy(), 0, 2)
-                x_sample = x_sample.astype(np.uint8)
+            for x_sample in samples_to_uint8(lowres_samples):
                 image = Image.fromarray(x_sample)
 
                 image = images.resize_image(
@@ -1391,13 +1763,16 @@ class StableDiffusionProcessingTxt2Img(StableDiffusionProcessing):
                     target_height,
                     upscaler_name=self.hr_upscaler,
                 )
-                image = np.array(image).astype(np.float32) / 255.0
-                image = np.moveaxis(image, 2, 0)
-                batch_images.append(image)
-
-            decoded_samples = torch.from_numpy(np.array(batch_images))
-            decoded_samples = decoded_samples.to(shared.device)
-            decoded_samples = 2.0 * decoded_samples - 1.0
+                batch_images.append(np.asarray(image))
+
+            # the upscaled batch goes to the device as uint8, a quarter of the float32 size, and is rescaled
+            # to -1..1 there in place, with the same arithmetic as the previous float32 / 255 on the host
+            decoded_samples = torch.from_numpy(np.stack(batch_images))
+            decoded_samples = decoded_samples.to(shared.device).permute(0, 3, 1, 2)
+            decoded_samples = decoded_samples.to(
+                torch.float32, memory_format=torch.contiguous_format
+            )
+            decoded_samples = decoded_samples.div_(255.0).mul_(2.0).sub_(1.0)
 
             samples = self.sd_model.get_first_stage_encoding(
                 self.sd_model.encode_first_stage(decoded_samples)
@@ -1490,31 +1865,21 @@ class StableDiffusionProcessingTxt2Img(StableDiffusionProcessing):
         if self.hr_negative_prompt == "":
             self.hr_negative_prompt = self.negative_prompt
 
-        if type(self.hr_prompt) == list:
-            self.all_hr_prompts = self.hr_prompt
-        else:
-            self.all_hr_prompts = self.batch_size * self.n_iter * [self.hr_prompt]
-
-        if type(self.hr_negative_prompt) == list:
-            self.all_hr_negative_prompts = self.hr_negative_prompt
-        else:
-            self.all_hr_negative_prompts = (
-                self.batch_size * self.n_iter * [self.hr_negative_prompt]
-            )
-
-        self.all_hr_prompts = [
-            shared.prompt_styles.apply_styles_to_prompt(x, self.styles)
-            for x in self.all_hr_prompts
-        ]
-        self.all_hr_negative_prompts = [
-            shared.prompt_styles.apply_negative_styles_to_prompt(x, self.styles)
-            for x in self.all_hr_negative_prompts
-        ]
+        self.all_hr_prompts = self.style_prompts(
+            self.hr_prompt, shared.prompt_styles.apply_styles_to_prompt
+        )
+        self.all_hr_negative_prompts = self.style_prompts(
+            self.hr_negative_prompt,
+            shared.prompt_styles.apply_negative_styles_to_prompt,
+        )
 
     def calculate_hr_conds(self):
         if self.hr_c is not None:
             return
 
+        # negative and positive prompts are encoded by separate calls on purpose: each can then be served by the
+        # first pass's cache when the hires prompts are unchanged, and encoding them together would pad both
+        # to the longer prompt's chunk count, which changes the conds
         self.hr_uc = self.get_conds_with_caching(
             prompt_parser.get_learned_conditioning,
             self.hr_negative_prompts,
@@ -1625,6 +1990,7 @@ class StableDiffusionProcessingImg2Img(StableDiffusionProcessing):
         self.init_img_hash = None
         self.mask_for_overlay = None
         self.init_latent = None
+        self.cached_masked_init_latent = None
 
         self.overlay_images = None
 
@@ -1658,16 +2024,25 @@ class StableDiffusionProcessingImg2Img(StableDiffusionProcessing):
             if self.inpainting_mask_invert:
                 image_mask = ImageOps.invert(image_mask)
 
-            if self.mask_blur_x > 0:
-                np_mask = np.array(image_mask)
-                kernel_size = 2 * int(2.5 * self.mask_blur_x + 0.5) + 1
-                np_mask = cv2.GaussianBlur(np_mask, (kernel_size, 1), self.mask_blur_x)
-                image_mask = Image.fromarray(np_mask)
-
-            if self.mask_blur_y > 0:
-                np_mask = np.array(image_mask)
-                kernel_size = 2 * int(2.5 * self.mask_blur_y + 0.5) + 1
-                np_mask = cv2.GaussianBlur(np_mask, (1, kernel_size), self.mask_blur_y)
+            # one separable 2D blur instead of a horizontal and a vertical pass; a kernel size of 1 leaves
+            # that direction untouched when its blur is off
+            if self.mask_blur_x > 0 or self.mask_blur_y > 0:
+                kernel_size_x = (
+                    2 * int(2.5 * self.mask_blur_x + 0.5) + 1
+                    if self.mask_blur_x > 0
+                    else 1
+                )
+                kernel_size_y = (
+                    2 * int(2.5 * self.mask_blur_y + 0.5) + 1
+                    if self.mask_blur_y > 0
+                    else 1
+                )
+                np_mask = cv2.GaussianBlur(
+                    np.asarray(image_mask),
+                    (kernel_size_x, kernel_size_y),
+                    sigmaX=self.mask_blur_x,
+                    sigmaY=self.mask_blur_y,
+                )
                 image_mask = Image.fromarray(np_mask)
 
             if self.inpaint_full_res:
@@ -1688,11 +2063,9 @@ class StableDiffusionProcessingImg2Img(StableDiffusionProcessing):
                 image_mask = images.resize_image(
                     self.resize_mode, image_mask, self.width, self.height
                 )
-                np_mask = np.array(image_mask)
-                np_mask = np.clip((np_mask.astype(np.float32)) * 2, 0, 255).astype(
-                    np.uint8
-                )
-                self.mask_for_overlay = Image.fromarray(np_mask)
+                # saturating uint8 addition is the same as the clipped float32 * 2, without the float copy
+                np_mask = np.asarray(image_mask)
+                self.mask_for_overlay = Image.fromarray(cv2.add(np_mask, np_mask))
 
             self.overlay_images = []
 
@@ -1703,72 +2076,151 @@ class StableDiffusionProcessingImg2Img(StableDiffusionProcessing):
         )
         if add_color_corrections:
             self.color_corrections = []
-        imgs = []
-        for img in self.init_images:
-            # Save init image
-            if opts.save_init_img:
-                self.init_img_hash = hashlib.md5(img.tobytes()).hexdigest()
-                images.save_image(
-                    img,
-                    path=opts.outdir_init_images,
-                    basename=None,
-                    forced_filename=self.init_img_hash,
-                    save_to_dirs=False,
-                )
+        # the same init image is often passed several times; it is only saved and prepared once, since
+        # everything below only depends on the image. Images are told apart by their hash when it is computed
+        # for saving anyway, and by identity otherwise; the hash only covers the pixel bytes, so it is paired
+        # with the size and mode, which can differ for the same bytes
+        saved_init_img_hashes = set()
+        init_img_hashes = {}
 
+        if image_mask is not None:
+            overlay_alpha = ImageOps.invert(self.mask_for_overlay.convert("L"))
+
+        # the same for every image, so only worked out once
+        resize_before_crop = crop_region is None and self.resize_mode != 3
+        fill_masked = image_mask is not None and self.inpainting_fill != 1
+        if fill_masked:
+            inverted_latent_mask = ImageOps.invert(latent_mask.convert("L"))
+
+        def prepare_init_image(img):
             image = images.flatten(img, opts.img2img_background_color)
 
-            if crop_region is None and self.resize_mode != 3:
+            if resize_before_crop:
                 image = images.resize_image(
                     self.resize_mode, image, self.width, self.height
                 )
 
+            image_masked = None
             if image_mask is not None:
-                image_masked = Image.new("RGBa", (image.width, image.height))
-                image_masked.paste(
-                    image.convert("RGBA").convert("RGBa"),
-                    mask=ImageOps.invert(self.mask_for_overlay.convert("L")),
-                )
-
-                self.overlay_images.append(image_masked.convert("RGBA"))
+                # the image with the inverted mask as its alpha; pasting it through the mask onto a transparent
+                # premultiplied image gave the same thing, but lost color precision where the alpha is low
+                image_masked = image.convert("RGB")
+                image_masked.putalpha(overlay_alpha)
 
             # crop_region is not None if we are doing inpaint full res
             if crop_region is not None:
                 image = image.crop(crop_region)
                 image = images.resize_image(2, image, self.width, self.height)
 
-            if image_mask is not None:
-                if self.inpainting_fill != 1:
-                    image = masking.fill(image, latent_mask)
+            if fill_masked:
+                image = masking.fill(
+                    image, latent_mask, inverted_mask=inverted_latent_mask
+                )
 
+            color_correction = None
             if add_color_corrections:
-                self.color_corrections.append(setup_color_correction(image))
+                color_correction = setup_color_correction(image)
+
+            return np.asarray(image), image_masked, color_correction
 
-            image = np.array(image).astype(np.float32) / 255.0
-            image = np.moveaxis(image, 2, 0)
+        image_keys = []
+        unique_images = {}
+        for img in self.init_images:
+            image_key = id(img)
+
+            # Save init image
+            if opts.save_init_img:
+                # the same image object passed several times is only hashed once
+                self.init_img_hash = init_img_hashes.get(image_key)
+                if self.init_img_hash is None:
+                    self.init_img_hash = hashlib.md5(img.tobytes()).hexdigest()
+                    init_img_hashes[image_key] = self.init_img_hash
+
+                image_key = (self.init_img_hash, img.size, img.mode)
+
+                if self.init_img_hash not in saved_init_img_hashes:
+                    saved_init_img_hashes.add(self.init_img_hash)
+                    images.save_image(
+                        img,
+                        path=opts.outdir_init_images,
+                        basename=None,
+                        forced_filename=self.init_img_hash,
+                        save_to_dirs=False,
+                    )
+
+            image_keys.append(image_key)
+            unique_images.setdefault(image_key, img)
+
+        # the images are independent and PIL, cv2 and numpy release the GIL for the heavy parts, so several are
+        # prepared at once; an img2img upscaler may run a model, which stays on this thread
+        upscaler_name = opts.upscaler_for_img2img
+        max_workers = min(len(unique_images), os.cpu_count() or 1)
+        executor = None
+        if max_workers > 1 and (upscaler_name is None or upscaler_name == "None"):
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        def map_images(func, *iterables):
+            return list((executor.map if executor else map)(func, *iterables))
+
+        try:
+            prepared = map_images(prepare_init_image, unique_images.values())
+            prepared_by_image = dict(zip(unique_images.keys(), prepared))
+
+            batch_arrays = []
+            for image_key in image_keys:
+                image, image_masked, color_correction = prepared_by_image[image_key]
+                batch_arrays.append(image)
+
+                if image_masked is not None:
+                    self.overlay_images.append(image_masked)
+
+                if add_color_corrections:
+                    self.color_corrections.append(color_correction)
+
+            height, width, channels = batch_arrays[0].shape
+            shape = (len(batch_arrays), channels, height, width)
+            if shared.device.type == "cuda":
+                # page-locked, so the upload below can run asynchronously
+                batch_images = torch.empty(
+                    shape, dtype=torch.float32, pin_memory=True
+                ).numpy()
+            else:
+                batch_images = np.empty(shape, dtype=np.float32)
 
-            imgs.append(image)
+            # the cast, the scaling and the HWC to CHW transpose are a single numpy pass per image, written
+            # straight into that image's slot of the batch, and the slots are filled concurrently too
+            def fill_slot(image, slot):
+                np.divide(image.transpose(2, 0, 1), np.float32(255.0), out=slot)
 
-        if len(imgs) == 1:
-            batch_images = np.expand_dims(imgs[0], axis=0).repeat(
-                self.batch_size, axis=0
-            )
+            map_images(fill_slot, batch_arrays, batch_images)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        repeat_single_image = len(batch_images) == 1
+        if repeat_single_image:
             if self.overlay_images is not None:
                 self.overlay_images = self.overlay_images * self.batch_size
 
             if self.color_corrections is not None and len(self.color_corrections) == 1:
                 self.color_corrections = self.color_corrections * self.batch_size
 
-        elif len(imgs) <= self.batch_size:
-            self.batch_size = len(imgs)
-            batch_images = np.array(imgs)
+        elif len(batch_images) <= self.batch_size:
+            self.batch_size = len(batch_images)
         else:
             raise RuntimeError(
-                f"bad number of images passed: {len(imgs)}; expecting {self.batch_size} or less"
+                f"bad number of images passed: {len(batch_images)}; expecting {self.batch_size} or less"
             )
 
+        # the copy goes as float32 and is cast on the device: converting on the host first would need a
+        # pageable temporary and make the copy synchronous again
         image = torch.from_numpy(batch_images)
-        image = image.to(shared.device, dtype=devices.dtype_vae)
+        image = image.to(shared.device, non_blocking=True).to(devices.dtype_vae)
+
+        # a single init image is uploaded once and repeated on the device rather than on the host; the copies
+        # have to be real, since the batch is rescaled in place below
+        if repeat_single_image and self.batch_size > 1:
+            image = image.expand(self.batch_size, -1, -1, -1).contiguous()
 
         if opts.sd_vae_encode_method != "Full":
             self.extra_generation_params["VAE Encoder"] = opts.sd_vae_encode_method
@@ -1778,7 +2230,9 @@ class StableDiffusionProcessingImg2Img(StableDiffusionProcessing):
             sd_samplers_common.approximation_indexes.get(opts.sd_vae_encode_method),
             self.sd_model,
         )
-        devices.torch_gc()
+        # as for the batches in process_images_inner, the cache is only released when in lowvram mode
+        if lowvram.is_enabled(self.sd_model):
+            devices.torch_gc()
 
         if self.resize_mode == 3:
             self.init_latent = torch.nn.functional.interpolate(
@@ -1789,20 +2243,18 @@ class StableDiffusionProcessingImg2Img(StableDiffusionProcessing):
 
         if image_mask is not None:
             init_mask = latent_mask
-            latmask = init_mask.convert("RGB").resize(
+            # resizing the single gray channel gives the same values as the first channel of the RGB resize;
+            # it is uploaded once as uint8 and thresholded on the device: round(value / 255) is 1 exactly
+            # when value >= 128, so the result goes straight to the model's dtype without a float32 pass
+            latmask = init_mask.convert("L").resize(
                 (self.init_latent.shape[3], self.init_latent.shape[2])
             )
-            latmask = np.moveaxis(np.array(latmask, dtype=np.float32), 2, 0) / 255
-            latmask = latmask[0]
-            latmask = np.around(latmask)
-            latmask = np.tile(latmask[None], (4, 1, 1))
+            latmask = torch.from_numpy(np.array(latmask)).to(shared.device)
+            nmask = latmask.ge(128).to(self.sd_model.dtype)
 
-            self.mask = (
-                torch.asarray(1.0 - latmask).to(shared.device).type(self.sd_model.dtype)
-            )
-            self.nmask = (
-                torch.asarray(latmask).to(shared.device).type(self.sd_model.dtype)
-            )
+            # mask and nmask are only ever read, so the four latent channels can share one plane
+            self.mask = (1.0 - nmask).expand(4, -1, -1)
+            self.nmask = nmask.expand(4, -1, -1)
 
             # this needs to be fixed to be done in sample() using actual seeds for batches
             if self.inpainting_fill == 2:
@@ -1817,8 +2269,9 @@ class StableDiffusionProcessingImg2Img(StableDiffusionProcessing):
             elif self.inpainting_fill == 3:
                 self.init_latent = self.init_latent * self.mask
 
+        # image is not needed in 0..1 anymore once it has been encoded, so it is rescaled in place
         self.image_conditioning = self.img2img_image_conditioning(
-            image * 2 - 1, self.init_latent, image_mask
+            image.mul_(2).sub_(1), self.init_latent, image_mask
         )
 
     def sample(
@@ -1848,13 +2301,40 @@ class StableDiffusionProcessingImg2Img(StableDiffusionProcessing):
         )
 
         if self.mask is not None:
-            samples = samples * self.nmask + self.init_latent * self.mask
+            # init_latent and mask stay the same for every batch, so their product is only computed again
+            # if a script replaces one of them
+            cached = self.cached_masked_init_latent
+            if (
+                cached is None
+                or cached[0] is not self.init_latent
+                or cached[1] is not self.mask
+            ):
+                cached = (self.init_latent, self.mask, self.init_latent * self.mask)
+                self.cached_masked_init_latent = cached
+
+            # one fused kernel for the masked blend instead of a product and a sum; it is written over the
+            # sampler's output unless that shares memory with init_latent
+            shares_init_latent = (
+                samples.untyped_storage().data_ptr()
+                == self.init_latent.untyped_storage().data_ptr()
+            )
+            samples = torch.addcmul(
+                cached[2],
+                samples,
+                self.nmask,
+                out=None if shares_init_latent else samples,
+            )
 
         del x
-        devices.torch_gc()
+        if lowvram.is_enabled(self.sd_model):
+            devices.torch_gc()
 
         return samples
 
+    def close(self):
+        super().close()
+        self.cached_masked_init_latent = None
+
     def get_token_merging_ratio(self, for_hr=False):
         return (
             self.token_merging_ratio
@@ -99,19 +99,18 @@ def create_generator(seed):
 
 # from https://discuss.pytorch.org/t/help-regarding-slerp-function-for-generative-model-sampling/32475/3
 def slerp(val, low, high):
-    low_norm = low / torch.norm(low, dim=1, keepdim=True)
-    high_norm = high / torch.norm(high, dim=1, keepdim=True)
-    dot = (low_norm * high_norm).sum(1)
+    low_inv_norm = torch.rsqrt((low * low).sum(1))
+    high_inv_norm = torch.rsqrt((high * high).sum(1))
+    dot = (low * high).sum(1) * low_inv_norm * high_inv_norm
 
-    if dot.mean() > 0.9995:
-        return low * val + high * (1 - val)
-
-    omega = torch.acos(dot)
+    # both results are computed and selected on the device, so that testing dot does not sync with the host
+    omega = torch.acos(dot.clamp(-1.0, 1.0))
     so = torch.sin(omega)
     res = (torch.sin((1.0 - val) * omega) / so).unsqueeze(1) * low + (
         torch.sin(val * omega) / so
     ).unsqueeze(1) * high
-    return res
+
+    return torch.where(dot.mean() > 0.9995, low * val + high * (1 - val), res)
 
 
 class ImageRNG:
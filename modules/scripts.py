@@ -497,6 +497,15 @@ class ScriptRunner:
                     f"Error running postprocess_batch: {script.filename}", exc_info=True
                 )
 
+    def has_postprocess_batch_list(self):
+        """Whether any alwayson script overrides postprocess_batch_list; if none does, callers can skip
+        splitting the batch into a list for it."""
+
+        return any(
+            type(script).postprocess_batch_list is not Script.postprocess_batch_list
+            for script in self.alwayson_scripts
+        )
+
     def postprocess_batch_list(self, p, pp: PostprocessBatchListArgs, **kwargs):
         for script in self.alwayson_scripts:
             try:
@@ -127,7 +127,8 @@ def images_tensor_to_samples(image, approximation=None, model=None):
     else:
         if model is None:
             model = shared.sd_model
-        model.first_stage_model.to(devices.dtype_vae)
+        with devices.without_inference_mode():
+            model.first_stage_model.to(devices.dtype_vae)
 
         image = image.to(shared.device, dtype=devices.dtype_vae)
         image = image * 2 - 1
@@ -228,7 +229,7 @@ def apply_refiner(cfg_denoiser):
     ] = refiner_checkpoint_info.short_title
     cfg_denoiser.p.extra_generation_params["Refiner switch at"] = refiner_switch_at
 
-    with sd_models.SkipWritingToConfig():
+    with sd_models.SkipWritingToConfig(), devices.without_inference_mode():
         sd_models.reload_model_weights(info=refiner_checkpoint_info)
 
     devices.torch_gc()
@@ -919,6 +919,14 @@ options_templates.update(
             "batch_cond_uncond": OptionInfo(True, "Batch cond/uncond").info(
                 "do both conditional and unconditional denoising in one batch; uses a bit more VRAM during sampling, but improves speed; previously this was controlled by --always-batch-cond-uncond comandline argument"
             ),
+            "use_inference_mode": OptionInfo(
+                False, "Use torch.inference_mode for generation"
+            ).info(
+                "less autograd bookkeeping than torch.no_grad; models, Loras and embeddings loaded lazily during generation become inference tensors, so disable if an extension fails with an error about inference tensors"
+            ),
+            "compile_vae_decoder": OptionInfo(False, "Compile VAE decoder").info(
+                "wrap VAE decoding in torch.compile; the first image of every new size is slower while it compiles; falls back to eager decoding if compiling fails"
+            ),
         },
     )
 )
@@ -2,6 +2,7 @@ import csv
 import datetime
 import html
 import os
+import stat
 from collections import namedtuple
 from contextlib import closing
 
@@ -108,19 +109,29 @@ class DirWithTextualInversionEmbeddings:
         self.path = path
         self.mtime = None
 
+    def stat_mtime(self):
+        """The directory's mtime from a single stat call, or None if it is not a directory."""
+
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+
+        return st.st_mtime if stat.S_ISDIR(st.st_mode) else None
+
     def has_changed(self):
-        if not os.path.isdir(self.path):
+        mt = self.stat_mtime()
+        if mt is None:
             return False
 
-        mt = os.path.getmtime(self.path)
-        if self.mtime is None or mt > self.mtime:
-            return True
+        return self.mtime is None or mt > self.mtime
 
     def update(self):
-        if not os.path.isdir(self.path):
+        mt = self.stat_mtime()
+        if mt is None:
             return
 
-        self.mtime = os.path.getmtime(self.path)
+        self.mtime = mt
 
 
 class EmbeddingDatabase: